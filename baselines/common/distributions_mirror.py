@@ -21,6 +21,9 @@ class Pd(object):
         raise NotImplementedError
     def sample(self):
         raise NotImplementedError
+    def sample_and_neglogp(self):
+        x = self.sample()
+        return x, self.neglogp(x)
     def logp(self, x):
         return - self.neglogp(x)
     def get_shape(self):
@@ -41,6 +44,8 @@ class PdType(object):
         return self.pdclass()(flat)
     def pdfromlatent(self, latent_vector, init_scale, init_bias):
         raise NotImplementedError
+    def pdparamfromlatent(self, latent_vector, init_scale, init_bias):
+        raise NotImplementedError
     def param_shape(self):
         raise NotImplementedError
     def sample_shape(self):
@@ -62,9 +67,10 @@ class CategoricalPdType(PdType):
     def pdclass(self):
         return CategoricalPd
     def pdfromlatent(self, latent_vector, init_scale=1.0, init_bias=0.0):
-        pdparam = _matching_fc(latent_vector, 'pi', self.ncat, init_scale=init_scale, init_bias=init_bias)
-        pdn = pdparam.shape[0]//2
-        return self.pdfromflat(pdparam[0:pdn,:]), pdparam
+        pdparam = self.pdparamfromlatent(latent_vector, init_scale=init_scale, init_bias=init_bias)
+        return self.pdfromflat(pdparam), pdparam
+    def pdparamfromlatent(self, latent_vector, init_scale=1.0, init_bias=0.0):
+        return _matching_fc(latent_vector, 'pi', self.ncat, init_scale=init_scale, init_bias=init_bias)
 
     def param_shape(self):
         return [self.ncat]
@@ -84,8 +90,10 @@ class MultiCategoricalPdType(PdType):
         return MultiCategoricalPd(self.ncats, flat)
 
     def pdfromlatent(self, latent, init_scale=1.0, init_bias=0.0):
-        pdparam = _matching_fc(latent, 'pi', self.ncats.sum(), init_scale=init_scale, init_bias=init_bias)
+        pdparam = self.pdparamfromlatent(latent, init_scale=init_scale, init_bias=init_bias)
         return self.pdfromflat(pdparam), pdparam
+    def pdparamfromlatent(self, latent, init_scale=1.0, init_bias=0.0):
+        return _matching_fc(latent, 'pi', self.ncats.sum(), init_scale=init_scale, init_bias=init_bias)
 
     def param_shape(self):
         return [sum(self.ncats)]
@@ -101,10 +109,12 @@ class DiagGaussianPdType(PdType):
         return DiagGaussianPd
 
     def pdfromlatent(self, latent_vector, init_scale=1.0, init_bias=0.0):
-        mean = _matching_fc(latent_vector, 'pi', self.size, init_scale=init_scale, init_bias=init_bias)
+        mean = self.pdparamfromlatent(latent_vector, init_scale=init_scale, init_bias=init_bias)
         logstd = tf.get_variable(name='pi/logstd', shape=[1, self.size], initializer=tf.zeros_initializer())
         pdparam = tf.concat([mean, mean * 0.0 + logstd], axis=1)
         return self.pdfromflat(pdparam), mean
+    def pdparamfromlatent(self, latent_vector, init_scale=1.0, init_bias=0.0):
+        return _matching_fc(latent_vector, 'pi', self.size, init_scale=init_scale, init_bias=init_bias)
 
     def param_shape(self):
         return [2*self.size]
@@ -125,8 +135,10 @@ class BernoulliPdType(PdType):
     def sample_dtype(self):
         return tf.int32
     def pdfromlatent(self, latent_vector, init_scale=1.0, init_bias=0.0):
-        pdparam = _matching_fc(latent_vector, 'pi', self.size, init_scale=init_scale, init_bias=init_bias)
+        pdparam = self.pdparamfromlatent(latent_vector, init_scale=init_scale, init_bias=init_bias)
         return self.pdfromflat(pdparam), pdparam
+    def pdparamfromlatent(self, latent_vector, init_scale=1.0, init_bias=0.0):
+        return _matching_fc(latent_vector, 'pi', self.size, init_scale=init_scale, init_bias=init_bias)
 
 # WRONG SECOND DERIVATIVES
 # class CategoricalPd(Pd):
@@ -200,6 +212,13 @@ class CategoricalPd(Pd):
     def sample(self):
         u = tf.random_uniform(tf.shape(self.logits), dtype=self.logits.dtype)
         return tf.argmax(self.logits - tf.log(-tf.log(u)), axis=-1)
+    def sample_and_neglogp(self):
+        # Gumbel-max sample and its neglogp computed from a single log_softmax
+        log_probs = tf.nn.log_softmax(self.logits)
+        u = tf.random_uniform(tf.shape(self.logits), dtype=self.logits.dtype)
+        x = tf.argmax(log_probs - tf.log(-tf.log(u)), axis=-1)
+        neglogp = -tf.reduce_sum(log_probs * tf.one_hot(x, self.logits.get_shape().as_list()[-1]), axis=-1)
+        return x, neglogp
     @classmethod
     def fromflat(cls, flat):
         return cls(flat)
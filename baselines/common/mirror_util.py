@@ -2,30 +2,43 @@ import tensorflow as tf
 import numpy as np
 
 
-def mirror_modify(mirror_original, game = None):
-    if game =='Pong':
-        return mirror_modify
-    elif game =='Breakout':
-        position = {0:[0,2],1:[3,4],2:[2,3]}
-    elif game == 'Qbert':
-        position = {0:[0,3],1:[4,5],2:[3,4],3:[5,6]}
-    elif game == 'BeamRider':
-        position = {0:[0,3],1:[4,5],2:[3,4],3:[6,7],4:[5,6],5:[8,9],6:[7,8]}
-    elif game == 'Enduro':
-        position = {0:[0,2],1:[3,4],2:[2,3],3:[4,5],4:[6,7],5:[5,6],6:[8,9],7:[7,8]}
-    elif game == 'Seaquest':
-        position = {0:[0,3],1:[4,5],2:[3,4],3:[5,6],4:[7,8],5:[6,7],6:[9,10],7:[8,9],8:[10,11],9:[12,13],10:[11,12],11:[13,14],12:[15,16],13:[14,15],14:[17,18],15:[16,17]}
-    elif game == None:
+# action index permutations that swap left/right actions of each game
+MIRROR_PERMUTATIONS = {
+    'Breakout': [0, 1, 3, 2],
+    'Qbert': [0, 1, 2, 4, 3, 5],
+    'BeamRider': [0, 1, 2, 4, 3, 6, 5, 8, 7],
+    'Enduro': [0, 1, 3, 2, 4, 6, 5, 8, 7],
+    'Seaquest': [0, 1, 2, 4, 3, 5, 7, 6, 9, 8, 10, 12, 11, 13, 15, 14, 17, 16],
+}
+
+
+def mirror_permutation(game=None):
+    """
+    Return the action permutation of the mirrored game as an int32 numpy array,
+    or None if the actions do not need to be permuted (e.g. Pong)
+    """
+    if game == 'Pong':
+        return None
+    elif game not in MIRROR_PERMUTATIONS:
         print('Sorry, the mirror mapping infomation is not in the mirror_modify function. No change will be done')
+        return None
+    return np.array(MIRROR_PERMUTATIONS[game], dtype=np.int32)
+
+
+def mirror_modify(mirror_original, game = None):
+    perm = mirror_permutation(game)
+    if perm is None:
         return mirror_original
-    lenp=len(position)
-    part = []
-    for i in range(lenp):
-        left = position[i][0]
-        right = position[i][1]
-        part.append(mirror_original[:,left:right])
-    mirror_final = tf.concat(part,axis=1)
-    return mirror_final
+    return tf.gather(mirror_original, tf.constant(perm, dtype=tf.int32), axis=1)
+
+
+def mirror_observations(obs):
+    """
+    Stack a batch of image observations [B, H, W, C] with its horizontally mirrored copy,
+    giving the [2B, H, W, C] batch expected by policies built with mirrored_input=True
+    """
+    obs = np.asarray(obs)
+    return np.concatenate([obs, obs[:, :, ::-1]], axis=0)
 
 
 def test_action(actions, game=None):
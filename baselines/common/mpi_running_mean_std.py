@@ -27,7 +27,10 @@ class RunningMeanStd(object):
         self.shape = shape
 
         self.mean = tf.to_float(self._sum / self._count)
-        self.std = tf.sqrt( tf.maximum( tf.to_float(self._sumsq / self._count) - tf.square(self.mean) , 1e-2 ))
+        var = tf.maximum( tf.to_float(self._sumsq / self._count) - tf.square(self.mean) , 1e-2 )
+        self.std = tf.sqrt(var)
+        # reciprocal of std, so that normalization can multiply instead of divide
+        self.inv_std = tf.rsqrt(var)
 
         newsum = tf.placeholder(shape=self.shape, dtype=tf.float64, name='sum')
         newsumsq = tf.placeholder(shape=self.shape, dtype=tf.float64, name='var')
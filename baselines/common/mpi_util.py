@@ -37,13 +37,15 @@ def gpu_count():
 def setup_mpi_gpus():
     """
     Set CUDA_VISIBLE_DEVICES to MPI rank if not already set
+    (ranks share GPUs round-robin when there are more ranks than GPUs on a machine)
     """
     if 'CUDA_VISIBLE_DEVICES' not in os.environ:
         if sys.platform == 'darwin': # This Assumes if you're on OSX you're just
             ids = []                 # doing a smoke test and don't want GPUs
         else:
             lrank, _lsize = get_local_rank_size(MPI.COMM_WORLD)
-            ids = [lrank]
+            ngpus = gpu_count()
+            ids = [lrank % ngpus] if ngpus > 0 else []
         os.environ["CUDA_VISIBLE_DEVICES"] = ",".join(map(str, ids))
 
 def get_local_rank_size(comm):
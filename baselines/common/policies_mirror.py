@@ -1,3 +1,7 @@
+import inspect
+from collections import namedtuple
+
+import numpy as np
 import tensorflow as tf
 from baselines.common import tf_util
 from baselines.a2c.utils import fc
@@ -9,13 +13,21 @@ from baselines.common.models import get_network_builder
 from baselines.common.mirror_util import mirror_modify
 import gym
 
+try:
+    from tensorflow.python.compiler.xla.jit import experimental_jit_scope as jit_scope
+except ImportError:
+    from tensorflow.contrib.compiler.jit import experimental_jit_scope as jit_scope
+
+# output of a policy network: recurrent is the dict of recurrent tensors (S, M, state, ...) or None
+PolicyOutput = namedtuple('PolicyOutput', 'latent recurrent')
+
 
 class PolicyWithValue(object):
     """
     Encapsulates fields and methods for RL policy and value function estimation with shared parameters
     """
 
-    def __init__(self, env, observations, latent, mirrorlatent, estimate_q=False, vf_latent=None, sess=None, env_name=None, **tensors):
+    def __init__(self, env, observations, latent, mirrorlatent, estimate_q=False, vf_latent=None, sess=None, env_name=None, mirror_loss_dtype=tf.float32, prebuild_callables=True, **tensors):
         """
         Parameters:
         ----------
@@ -25,10 +37,19 @@ class PolicyWithValue(object):
 
         latent          latent state from which policy distribution parameters should be inferred
 
+        mirrorlatent    latent state of the mirrored observations (if None, mirror losses are not built)
+
         vf_latent       latent state from which value function should be inferred (if None, then latent is used)
 
         sess            tensorflow session to run calculations in (if None, default session is used)
 
+        env_name        name of the Atari game, used to permute the mirrored actions
+
+        mirror_loss_dtype   dtype the mirror losses are computed in (e.g. tf.bfloat16 to halve their memory traffic),
+                            the resulting losses are always float32
+
+        prebuild_callables  build the step/value session callables at construction (for policies used for acting)
+
         **tensors       tensorflow tensors for additional attributes such as state or mask
 
         """
@@ -37,33 +58,22 @@ class PolicyWithValue(object):
         self.state = tf.constant([])
         self.initial_state = None
         self.__dict__.update(tensors)
+        # placeholders that can be fed through **extra_feed in step/value
+        self._placeholder_attrs = {name: t for name, t in self.__dict__.items() if isinstance(t, tf.Tensor) and t.op.type == 'Placeholder'}
+        # per-sample observation shape, resolved once so that _evaluate can skip adjust_shape
+        self._obs_target_shape = tuple(self.X.shape.as_list()[1:])
 
         vf_latent = vf_latent if vf_latent is not None else latent
-        vf_latent = tf.layers.flatten(vf_latent)
-        latent = tf.layers.flatten(latent)
-        
-        mirror_vf_latent = mirrorlatent
-        mirrorlatent = tf.layers.flatten(mirrorlatent)
-        mirror_vf_latent = tf.layers.flatten(mirror_vf_latent)
-        
-        latent_all = tf.concat([latent,mirrorlatent], axis=0)
-        
-        vf_latent_all = tf.concat([vf_latent,mirror_vf_latent], axis=0)
+        vf_latent = _static_flatten(vf_latent)
+        latent = _static_flatten(latent)
+
         # Based on the action space, will select what probability distribution type
         self.pdtype = make_pdtype(env.action_space)
-        
-        self.pd, self.pi_all = self.pdtype.pdfromlatent(latent_all, init_scale=0.01)
-        self.pi = self.pi_all[0:latent.shape[0],:]
-        pi_mirror = self.pi_all[latent.shape[0]:,:]
-        # Take an action
-        self.action = self.pd.sample()
-        pi_mirror = mirror_modify(pi_mirror, game=env_name)
-        pi_origin = tf.nn.softmax(self.pi)
-        pi_mirror = tf.nn.softmax(pi_mirror)
-        # policy mirror loss
-        self.policy_mirrorloss = tf.reduce_mean(tf.square(pi_origin - pi_mirror), 1)
-        # Calculate the neg log of our probability
-        self.neglogp = self.pd.neglogp(self.action)
+
+        self.pd, self.pi = self.pdtype.pdfromlatent(latent, init_scale=0.01)
+        # Take an action and calculate the neg log of its probability
+        # (not under jit_scope: XLA-compiled random ops ignore tf.set_random_seed)
+        self.action, self.neglogp = self.pd.sample_and_neglogp()
         self.sess = sess or tf.get_default_session()
 
         if estimate_q:
@@ -71,24 +81,65 @@ class PolicyWithValue(object):
             self.q = fc(vf_latent, 'q', env.action_space.n)
             self.vf = self.q
         else:
-            vf_all = fc(vf_latent_all, 'vf', 1)
-            self.vf = vf_all[0:vf_latent.shape[0],:]
-            self.vf = self.vf[:,0]
-            vf_mirror = vf_all[vf_latent.shape[0]:,:]
-            vf_mirror = vf_mirror[:,0]
-        # value mirror loss
-        self.value_mirrorloss = tf.square(self.vf - vf_mirror)
+            self.vf = tf.squeeze(fc(vf_latent, 'vf', 1), axis=-1)
+
+        if mirrorlatent is not None:
+            mirrorlatent = _static_flatten(mirrorlatent)
+            mirror_vf_latent = mirrorlatent
+
+            # the mirrored branch shares the 'pi' and 'vf' weights rather than being concatenated into the same batch
+            with tf.variable_scope(tf.get_variable_scope(), reuse=tf.AUTO_REUSE):
+                pi_mirror = self.pdtype.pdparamfromlatent(mirrorlatent, init_scale=0.01)
+                if not estimate_q:
+                    vf_mirror = tf.squeeze(fc(mirror_vf_latent, 'vf', 1), axis=-1)
+
+            pi_mirror = mirror_modify(pi_mirror, game=env_name)
+            # let XLA fuse the elementwise mirror loss chains into single kernels
+            with jit_scope(), tf.variable_scope('mirror_loss'):
+                # a single softmax over both branches, shape [2, batch, nact]
+                probs_all = tf.cast(tf.nn.softmax(tf.stack([self.pi, pi_mirror], axis=0)), mirror_loss_dtype)
+                probs_origin, probs_mirror = tf.unstack(probs_all, num=2, axis=0)
+                # policy mirror loss
+                self.policy_mirrorloss = tf.cast(tf.reduce_mean(tf.squared_difference(probs_origin, probs_mirror), 1), tf.float32)
+                if not estimate_q:
+                    # value mirror loss
+                    vf_origin = tf.cast(self.vf, mirror_loss_dtype)
+                    vf_mirror = tf.cast(vf_mirror, mirror_loss_dtype)
+                    self.value_mirrorloss = tf.cast(tf.squared_difference(vf_origin, vf_mirror), tf.float32)
+
+        self._step_fetches = [self.action, self.vf, self.state, self.neglogp]
+        # session callables keyed on (fetches, names of the fed placeholders), see _evaluate
+        self._callable_cache = {}
+        if prebuild_callables and self.sess is not None:
+            # specialize step and value once for the feeds of this policy (observations plus e.g. S and M
+            # of recurrent policies), so that rollouts never build a callable on the fly
+            extra_inpt_names = tuple(sorted(name for name in self._placeholder_attrs if name != 'X'))
+            for variables in (self._step_fetches, self.vf):
+                self._get_callable(variables, extra_inpt_names)
+
+    def _get_callable(self, variables, inpt_names):
+        fetch_key = tuple(variables) if isinstance(variables, list) else variables
+        key = (fetch_key, inpt_names)
+        fn = self._callable_cache.get(key)
+        if fn is None:
+            self.sess = self.sess or tf.get_default_session()
+            if self.sess is None:
+                raise ValueError('PolicyWithValue has no session: pass sess or evaluate it within a default session')
+            inpts = [self._placeholder_attrs[inpt_name] for inpt_name in inpt_names]
+            fn = self._callable_cache[key] = self.sess.make_callable(variables, feed_list=[self.X] + inpts)
+        return fn
 
     def _evaluate(self, variables, observation, **extra_feed):
-        sess = self.sess
-        feed_dict = {self.X: adjust_shape(self.X, observation)}
-        for inpt_name, data in extra_feed.items():
-            if inpt_name in self.__dict__.keys():
-                inpt = self.__dict__[inpt_name]
-                if isinstance(inpt, tf.Tensor) and inpt._op.type == 'Placeholder':
-                    feed_dict[inpt] = adjust_shape(inpt, data)
+        inpt_names = tuple(sorted(inpt_name for inpt_name in extra_feed if inpt_name in self._placeholder_attrs))
+        fn = self._get_callable(variables, inpt_names)
+        return fn(self._adjust_observation(observation), *[adjust_shape(self._placeholder_attrs[inpt_name], extra_feed[inpt_name]) for inpt_name in inpt_names])
 
-        return sess.run(variables, feed_dict)
+    def _adjust_observation(self, observation):
+        if not isinstance(observation, np.ndarray) or None in self._obs_target_shape:
+            return adjust_shape(self.X, observation)
+        if observation.shape[1:] == self._obs_target_shape:
+            return observation
+        return observation.reshape((-1,) + self._obs_target_shape)
 
     def step(self, observation, **extra_feed):
         """
@@ -106,7 +157,7 @@ class PolicyWithValue(object):
         (action, value estimate, next state, negative log likelihood of the action under current policy parameters) tuple
         """
 
-        a, v, state, neglogp = self._evaluate([self.action, self.vf, self.state, self.neglogp], observation, **extra_feed)
+        a, v, state, neglogp = self._evaluate(self._step_fetches, observation, **extra_feed)
         if state.size == 0:
             state = None
         return a, v, state, neglogp
@@ -134,46 +185,60 @@ class PolicyWithValue(object):
     def load(self, load_path):
         tf_util.load_state(load_path, sess=self.sess)
 
-def build_mirror_policy(env, policy_network, value_network=None,  normalize_observations=False, estimate_q=False, env_name=None, **policy_kwargs):
+def build_mirror_policy(env, policy_network, value_network=None,  normalize_observations=False, estimate_q=False, env_name=None, mirror_loss_dtype=tf.float32, **policy_kwargs):
     if isinstance(policy_network, str):
         network_type = policy_network
         policy_network = get_network_builder(network_type)(**policy_kwargs)
+    policy_output_network = _policy_output_network(policy_network)
 
-    def policy_fn(nbatch=None, nsteps=None, sess=None, observ_placeholder=None):
+    def policy_fn(nbatch=None, nsteps=None, sess=None, observ_placeholder=None, mirror=True, mirrored_input=False):
         ob_space = env.observation_space
+        assert mirror or not mirrored_input, 'mirrored_input requires mirror=True'
+
+        # with mirrored_input, X holds nbatch observations followed by their mirror images
+        batch_size = 2 * nbatch if mirrored_input and nbatch is not None else nbatch
+        X = observ_placeholder if observ_placeholder is not None else observation_placeholder(ob_space, batch_size=batch_size)
 
-        X = observ_placeholder if observ_placeholder is not None else observation_placeholder(ob_space, batch_size=nbatch)
-        # mirror
-        X_mirror = tf.reverse(X, axis=[2])
         extra_tensors = {}
         if normalize_observations and X.dtype == tf.float32:
-            encoded_x, rms = _normalize_clip_observation(X)
-            
-            encoded_x_mirror, _ = _normalize_clip_observation(X_mirror)
+            encoded_x, rms = _normalize_clip_observation(X, mirrored_input=mirrored_input)
             extra_tensors['rms'] = rms
         else:
             encoded_x = X
-            encoded_x_mirror = X_mirror
 
         encoded_x = encode_observation(ob_space, encoded_x)
-        encoded_x_mirror = encode_observation(ob_space,encoded_x_mirror)
+        if mirrored_input:
+            # the mirror images were produced on the host, see mirror_util.mirror_observations
+            encoded_x_both = encoded_x
+            encoded_x, encoded_x_mirror = tf.split(encoded_x_both, 2, axis=0)
+        elif mirror:
+            # mirror the already normalized observations, so that both branches share one RunningMeanStd
+            encoded_x_mirror = encoded_x[:, :, ::-1]
+            encoded_x_both = tf.concat([encoded_x, encoded_x_mirror], axis=0)
 
         with tf.variable_scope('pi', reuse=tf.AUTO_REUSE):
-            policy_latent = policy_network(encoded_x)
-            
-            policy_latent_mirror = policy_network(encoded_x_mirror)
-            if isinstance(policy_latent, tuple):
-                policy_latent, recurrent_tensors = policy_latent
-                policy_latent_mirror, recurrent_tensors_mirror = policy_latent_mirror
-
-                if recurrent_tensors is not None:
-                    # recurrent architecture, need a few more steps
-                    nenv = nbatch // nsteps
-                    assert nenv > 0, 'Bad input for recurrent policy: batch size {} smaller than nsteps {}'.format(nbatch, nsteps)
-                    policy_latent, recurrent_tensors = policy_network(encoded_x, nenv)
-                    policy_latent_mirror, recurrent_tensors_mirror = policy_network(encoded_x_mirror,nenv)
-                    extra_tensors.update(recurrent_tensors)
-
+            policy_output = None
+            policy_latent_mirror = None
+            if policy_output_network.takes_nenv and nbatch is not None and nsteps is not None and nbatch // nsteps > 0:
+                nenv = nbatch // nsteps
+                policy_output = policy_output_network(encoded_x, nenv)
+
+            if policy_output is not None and policy_output.recurrent is not None:
+                # recurrent architecture, the branches are run separately since the state placeholders are sized per env
+                policy_latent, recurrent_tensors = policy_output
+                if mirror:
+                    policy_latent_mirror, _ = policy_output_network(encoded_x_mirror, nenv)
+                extra_tensors.update(recurrent_tensors)
+            else:
+                if mirror:
+                    # original and mirrored observations go through the network as one batch
+                    policy_latent, recurrent_tensors = policy_output_network(encoded_x_both)
+                else:
+                    policy_latent, recurrent_tensors = policy_output_network(encoded_x)
+                assert recurrent_tensors is None, 'Bad input for recurrent policy: needs nbatch >= nsteps, got nbatch {} and nsteps {}'.format(nbatch, nsteps)
+                if mirror:
+                    # flatten once for both branches before splitting them apart
+                    policy_latent, policy_latent_mirror = tf.split(_static_flatten(policy_latent), 2, axis=0)
 
         _v_net = value_network
 
@@ -198,6 +263,9 @@ def build_mirror_policy(env, policy_network, value_network=None,  normalize_obse
             sess=sess,
             estimate_q=estimate_q,
             env_name=env_name,
+            mirror_loss_dtype=mirror_loss_dtype,
+            # a policy fed mirrored input (the training model) is never used for acting
+            prebuild_callables=not mirrored_input,
             **extra_tensors
         )
         return policy
@@ -205,8 +273,43 @@ def build_mirror_policy(env, policy_network, value_network=None,  normalize_obse
     return policy_fn
 
 
-def _normalize_clip_observation(x, clip_range=[-5.0, 5.0]):
+def _normalize_clip_observation(x, clip_range=[-5.0, 5.0], mirrored_input=False):
     rms = RunningMeanStd(shape=x.shape[1:])
-    norm_x = tf.clip_by_value((x - rms.mean) / rms.std, min(clip_range), max(clip_range))
-    return norm_x, rms
+    if not mirrored_input:
+        norm_x = tf.clip_by_value((x - rms.mean) * rms.inv_std, min(clip_range), max(clip_range))
+        return norm_x, rms
+
+    # x holds a batch followed by its mirror images: normalize the second half with mirrored statistics,
+    # which equals mirroring the normalized first half, as done for in-graph mirroring
+    mean = tf.stack([rms.mean, rms.mean[:, ::-1]])[:, None]
+    inv_std = tf.stack([rms.inv_std, rms.inv_std[:, ::-1]])[:, None]
+    x_halves = tf.reshape(x, [2, -1] + x.shape.as_list()[1:])
+    norm_x = tf.clip_by_value((x_halves - mean) * inv_std, min(clip_range), max(clip_range))
+    return tf.reshape(norm_x, tf.shape(x)), rms
+
+
+def _static_flatten(x):
+    """
+    Flatten x to [batch, features] with a single reshape; unlike tf.layers.flatten this
+    does not need a runtime shape op since the non-batch dimensions are static
+    """
+    if x.shape.ndims == 2:
+        return x
+    return tf.reshape(x, [-1, int(np.prod(x.shape.as_list()[1:]))])
+
+
+def _policy_output_network(network_fn):
+    """
+    Wrap network_fn so that it always returns a PolicyOutput. Whether network_fn takes nenv
+    is resolved once here; networks that do may still be feed-forward and return recurrent=None.
+    """
+    takes_nenv = 'nenv' in inspect.signature(network_fn).parameters
+
+    def policy_output_fn(X, nenv=None):
+        output = network_fn(X, nenv) if takes_nenv and nenv is not None else network_fn(X)
+        if isinstance(output, tuple):
+            return PolicyOutput(*output)
+        return PolicyOutput(output, None)
 
+    policy_output_fn.takes_nenv = takes_nenv
+    return policy_output_fn
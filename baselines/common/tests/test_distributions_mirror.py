@@ -0,0 +1,23 @@
+import numpy as np
+import tensorflow as tf
+
+from baselines.common.distributions_mirror import CategoricalPd
+
+
+def test_categorical_sample_and_neglogp():
+    np.random.seed(0)
+    nsamples = 20000
+    logits = np.array([1.0, -0.5, 0.3, 2.0], dtype=np.float32)
+    probs = np.exp(logits) / np.exp(logits).sum()
+
+    with tf.Graph().as_default(), tf.Session() as sess:
+        tf.set_random_seed(0)
+        pd = CategoricalPd(tf.constant(np.repeat(logits[None, :], nsamples, axis=0)))
+        action, neglogp = pd.sample_and_neglogp()
+        action, neglogp, expected_neglogp = sess.run([action, neglogp, pd.neglogp(action)])
+
+    # neglogp is the negative log probability of the sampled action
+    assert np.allclose(neglogp, expected_neglogp, atol=1e-5)
+    # actions are distributed as softmax(logits)
+    freqs = np.bincount(action, minlength=len(logits)) / nsamples
+    assert np.allclose(freqs, probs, atol=0.02)
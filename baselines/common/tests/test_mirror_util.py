@@ -0,0 +1,56 @@
+import numpy as np
+import tensorflow as tf
+
+from baselines.common.mirror_util import MIRROR_PERMUTATIONS, mirror_permutation, mirror_modify, mirror_observations
+from baselines.common.policies_mirror import _normalize_clip_observation
+
+
+def test_mirror_permutation():
+    for game, perm in MIRROR_PERMUTATIONS.items():
+        perm = mirror_permutation(game)
+        assert sorted(perm) == list(range(len(perm)))
+        # mirroring twice gives back the original actions
+        assert np.array_equal(perm[perm], np.arange(len(perm)))
+
+    assert mirror_permutation('Pong') is None
+
+
+def test_mirror_modify():
+    logits = np.arange(8, dtype=np.float32).reshape(2, 4)
+    with tf.Graph().as_default(), tf.Session() as sess:
+        mirrored = sess.run(mirror_modify(tf.constant(logits), game='Breakout'))
+
+    assert np.array_equal(mirrored, logits[:, [0, 1, 3, 2]])
+
+
+def test_mirror_observations():
+    obs = np.random.randint(0, 255, size=(3, 4, 5, 2)).astype(np.uint8)
+    mirrored = mirror_observations(obs)
+    assert mirrored.shape == (6, 4, 5, 2)
+
+    # policies built with mirrored_input split the batch back with tf.split
+    with tf.Graph().as_default(), tf.Session() as sess:
+        X = tf.placeholder(tf.uint8, shape=(None, 4, 5, 2))
+        x, x_mirror = sess.run(tf.split(X, 2, axis=0), {X: mirrored})
+
+    assert np.array_equal(x, obs)
+    assert np.array_equal(x_mirror, obs[:, :, ::-1])
+
+
+def test_normalize_mirrored_input():
+    np.random.seed(0)
+    obs = np.random.randn(3, 4, 5, 2).astype(np.float32)
+    with tf.Graph().as_default(), tf.Session() as sess:
+        X = tf.placeholder(tf.float32, shape=(None, 4, 5, 2))
+        with tf.variable_scope('normalize', reuse=tf.AUTO_REUSE):
+            norm_x, rms = _normalize_clip_observation(X)
+            norm_x_both, _ = _normalize_clip_observation(X, mirrored_input=True)
+        sess.run(tf.global_variables_initializer())
+        # statistics that are not symmetric under a horizontal flip
+        rms.update(np.random.randn(16, 4, 5, 2) + np.arange(5)[None, None, :, None])
+
+        normalized = sess.run(norm_x, {X: obs})
+        x, x_mirror = np.split(sess.run(norm_x_both, {X: mirror_observations(obs)}), 2)
+
+    assert np.allclose(x, normalized, atol=1e-5)
+    assert np.allclose(x_mirror, normalized[:, :, ::-1], atol=1e-5)
@@ -3,6 +3,7 @@ import functools
 
 from baselines.common.tf_util import get_session, save_variables, load_variables
 from baselines.common.tf_util import initialize
+from baselines.common.mirror_util import mirror_observations
 
 try:
     from baselines.common.mpi_adam_optimizer import MpiAdamOptimizer
@@ -35,13 +36,19 @@ class Model(object):
         with tf.variable_scope('ppo2_model', reuse=tf.AUTO_REUSE):
             # CREATE OUR TWO MODELS
             # act_model that is used for sampling
-            act_model = policy(nbatch_act, 1, sess)
+            if mirror:
+                # the mirror losses are only needed for training, keep the sampling graph single-branch
+                act_model = policy(nbatch_act, 1, sess, mirror=False)
+            else:
+                act_model = policy(nbatch_act, 1, sess)
 
             # Train model for training
+            # with mirror, the train model is fed the observations stacked with their mirror images
+            train_kwargs = {'mirrored_input': True} if mirror else {}
             if microbatch_size is None:
-                train_model = policy(nbatch_train, nsteps, sess)
+                train_model = policy(nbatch_train, nsteps, sess, **train_kwargs)
             else:
-                train_model = policy(microbatch_size, nsteps, sess)
+                train_model = policy(microbatch_size, nsteps, sess, **train_kwargs)
 
         # CREATE THE PLACEHOLDERS
         self.A = A = train_model.pdtype.sample_placeholder([None])
@@ -121,6 +128,7 @@ class Model(object):
         self.loss_names = ['policy_loss', 'value_loss', 'policy_entropy', 'approxkl', 'clipfrac']
         self.stats_list = [pg_loss, vf_loss, entropy, approxkl, clipfrac]
 
+        self.mirror = mirror
         self.train_model = train_model
         self.act_model = act_model
         self.step = act_model.step
@@ -143,6 +151,9 @@ class Model(object):
         # Normalize the advantages
         advs = (advs - advs.mean()) / (advs.std() + 1e-8)
 
+        if self.mirror:
+            obs = mirror_observations(obs)
+
         td_map = {
             self.train_model.X : obs,
             self.A : actions,
@@ -16,6 +16,7 @@ from importlib import import_module
 from baselines.common.mirror_util import test_action
 try:
     from mpi4py import MPI
+    from baselines.common.mpi_util import setup_mpi_gpus
 except ImportError:
     MPI = None
 
@@ -240,6 +241,10 @@ def main(args):
         rank = MPI.COMM_WORLD.Get_rank()
         configure_logger(args.log_path, format_strs=[])
 
+    if MPI is not None and MPI.COMM_WORLD.Get_size() > 1:
+        # data-parallel training: one GPU per worker, set before build_env/learn create a session
+        setup_mpi_gpus()
+
     model, env, env_type = train(args, extra_args)
 
     if args.save_path is not None and rank == 0: